@@ -0,0 +1,49 @@
+"""Personal agendas for LBW attendees."""
+import heapq
+
+from registration.models import Activity
+
+
+def find_overlaps(activities):
+  """Return the pairs of activities whose times overlap.
+
+  activities must be sorted by start_date; unscheduled ones are skipped.
+  This sweeps through them keeping a heap of the activities still running,
+  so it costs O(n log n) plus the number of overlaps rather than comparing
+  every pair.
+  """
+  running = []
+  overlaps = []
+  for activity in activities:
+    if not activity.start_date:
+      continue
+    while running and running[0][0] <= activity.start_date:
+      heapq.heappop(running)
+    overlaps.extend((other, activity) for _, _, other in running)
+    heapq.heappush(running, (activity.end_date(), activity.id, activity))
+  return overlaps
+
+
+def get_agenda(lbw_id, user):
+  """All the activities a user attends at an LBW, with their clashes."""
+  activities = list(Activity.objects.filter(
+      lbw_id=lbw_id, attendees=user).prefetch_related('owners'))
+  overlaps = find_overlaps(activities)
+  clashing = set()
+  for first, second in overlaps:
+    clashing.add(first.id)
+    clashing.add(second.id)
+  return {'activities': activities,
+          'overlaps': overlaps,
+          'clashing': clashing}
+
+
+def get_clashes(activity, user):
+  """The other activities of user that overlap with activity."""
+  clashes = []
+  for first, second in get_agenda(activity.lbw_id, user)['overlaps']:
+    if first.id == activity.id:
+      clashes.append(second)
+    elif second.id == activity.id:
+      clashes.append(first)
+  return clashes
@@ -7,8 +7,10 @@ from django import forms
 from registration.models import Lbw
 from registration.models import Accommodation
 from registration.models import Activity
+from registration.models import ChunkedUpload
 from registration.models import UserRegistration
 from registration.models import Message
+from registration.models import Ride
 
 
 # pylint: disable=W0232
@@ -34,23 +36,51 @@ class LbwForm(forms.ModelForm):
 
 class ActivityForm(forms.ModelForm):
   """Activity create/update form."""
+  # The attachment is stored by the view under its content hash, either from
+  # this field or from a finished chunked upload named by attachment_upload.
   attachment = forms.FileField(required=False)
+  attachment_upload = forms.IntegerField(required=False,
+                                         widget=forms.HiddenInput)
   
   class Meta:
     """Meta."""
     model = Activity
     fields = ('short_name', 'description', 'start_date',
               'duration', 'preferred_days', 'activity_type',
-              'owners', 'attachment', 'attachment_type')
+              'owners', 'attachment_type')
     widgets = {
         'start_date': forms.TextInput(attrs={'class': 'datetimepicker'}),
         }
 
   def __init__(self, *args, **kwargs):
+    self.user = None
+    if 'user' in kwargs:
+      self.user = kwargs['user']
+      del(kwargs['user'])
     super(ActivityForm, self).__init__(*args, **kwargs)
     self.helper = FormHelper()
     self.helper.form_method = 'post'
 
+  def clean_attachment_upload(self):
+    """Turn the upload id into the user's finished ChunkedUpload."""
+    upload_id = self.cleaned_data.get('attachment_upload')
+    if not upload_id:
+      return None
+    try:
+      upload = ChunkedUpload.objects.get(pk=upload_id, user=self.user)
+    except ChunkedUpload.DoesNotExist:
+      raise forms.ValidationError('The uploaded attachment could not be found, please attach it again.')
+    if not upload.finished():
+      raise forms.ValidationError('The attachment has not finished uploading, please submit again to resume.')
+    return upload
+
+  def clean(self):
+    cleaned_data = super(ActivityForm, self).clean()
+    # attachment_upload is hidden, so its errors would not be shown next to it.
+    if 'attachment_upload' in self.errors:
+      raise forms.ValidationError(self.errors['attachment_upload'])
+    return cleaned_data
+
 class UserRegistrationForm(forms.ModelForm):
   """LBW User registration form."""
   class Meta:
@@ -103,3 +133,20 @@ class AccommodationForm(forms.ModelForm):
     self.helper = FormHelper()
     self.helper.form_method = 'post'
     self.helper.add_input(Submit("submit", "Add"))
+
+class RideForm(forms.ModelForm):
+  """Ride offer/request form."""
+  class Meta:
+    """Meta."""
+    model = Ride
+    fields = ('ride_from', 'ride_to', 'ride_date', 'notes')
+    widgets = {
+        'ride_date': forms.TextInput(attrs={'class': 'datetimepicker'}),
+    }
+
+  def __init__(self, *args, **kwargs):
+    super(RideForm, self).__init__(*args, **kwargs)
+    self.helper = FormHelper()
+    self.helper.form_method = 'post'
+    self.helper.add_input(Submit("submit", "Offer"))
+    self.helper.add_input(Submit("submit", "Request"))
@@ -0,0 +1,13 @@
+"""Remove abandoned chunked uploads."""
+from django.core.management.base import BaseCommand
+
+from registration import uploads
+
+
+class Command(BaseCommand):
+  help = ('Remove attachment uploads older than LBW_UPLOAD_EXPIRY_HOURS and '
+          'their partial files.  Run it regularly, e.g. from cron.')
+
+  def handle(self, *args, **options):
+    removed = uploads.expire_uploads()
+    self.stdout.write('Removed %d expired uploads\n' % removed)
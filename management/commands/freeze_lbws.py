@@ -0,0 +1,41 @@
+"""Pre-render the public pages of finished LBWs."""
+import json
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+from registration import snapshots
+from registration import views
+from registration.models import Lbw
+
+
+class Command(BaseCommand):
+  args = '[lbw_id ...]'
+  help = ('Freeze the public pages and JSON export of finished LBWs '
+          '(all of them if no ids are given).')
+
+  def handle(self, *args, **options):
+    lbws = Lbw.objects.filter(end_date__lt=timezone.now(), hidden=False)
+    if args:
+      lbws = lbws.filter(pk__in=args)
+    factory = RequestFactory()
+    for lbw in lbws:
+      snapshots.thaw_lbw(lbw.id)
+      pages = [('detail', {}), ('accommodation', {}),
+               ('activities', {}), ('schedule', {})]
+      pages += [('activity', {'activity_id': str(activity.id)})
+                for activity in lbw.activity.all()]
+      for name, kwargs in pages:
+        kwargs['lbw_id'] = str(lbw.id)
+        request = factory.get(reverse('registration:%s' % name, kwargs=kwargs))
+        request.user = AnonymousUser()
+        # The frozen decorator writes the snapshot while serving the page.
+        getattr(views, name)(request, **kwargs)
+      if not snapshots.write_snapshot(lbw.id, 'details.json',
+                                      json.dumps(views.get_lbw_details(lbw))):
+        raise CommandError('Cannot write snapshots to %s' % snapshots.SNAPSHOT_DIR)
+      self.stdout.write('Froze %s (%d pages)\n' % (lbw, len(pages) + 1))
@@ -0,0 +1,19 @@
+"""Delete hidden LBWs and cancelled activities."""
+from django.core.management.base import BaseCommand
+
+from registration import purge
+from registration.models import Activity
+from registration.models import Lbw
+
+
+class Command(BaseCommand):
+  help = ('Delete the LBWs and activities owners have deleted, in small '
+          'batches.  Run it regularly, e.g. from cron.')
+
+  def handle(self, *args, **options):
+    for activity_id in Activity.objects.filter(cancelled=True).values_list('id', flat=True):
+      deleted = purge.purge_activity(activity_id)
+      self.stdout.write('Purged activity %d (%d rows)\n' % (activity_id, deleted))
+    for lbw_id in Lbw.objects.filter(hidden=True).values_list('id', flat=True):
+      deleted = purge.purge_lbw(lbw_id)
+      self.stdout.write('Purged LBW %d (%d rows)\n' % (lbw_id, deleted))
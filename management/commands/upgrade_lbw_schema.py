@@ -0,0 +1,121 @@
+"""Bring an existing LBW database up to date with the models.
+
+The app has no migrations, so syncdb only ever creates missing tables.  This
+command adds the columns, indexes and constraints that were added to
+existing tables since, and is safe to run more than once.
+"""
+import copy
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.db.models import Max
+from django.utils import timezone
+
+from registration.models import Activity
+from registration.models import Lbw
+from registration.models import Message
+from registration.models import Ride
+from registration.models import UserRegistration
+
+
+def get_constraints(model):
+  cursor = connection.cursor()
+  return connection.introspection.get_constraints(cursor, model._meta.db_table)
+
+
+def get_columns(model):
+  """Map the columns of model's table to whether they allow NULL."""
+  cursor = connection.cursor()
+  return dict((column[0], column[6]) for column in
+              connection.introspection.get_table_description(
+                  cursor, model._meta.db_table))
+
+
+def add_missing_fields(editor, model, names):
+  """Add the columns of fields that do not exist yet, returning their names."""
+  columns = get_columns(model)
+  added = []
+  for name in names:
+    field = model._meta.get_field(name)
+    if field.column not in columns:
+      editor.add_field(model, field)
+      added.append(name)
+  return added
+
+
+def make_nullable(editor, model, names):
+  """Drop NOT NULL from the columns of fields that now allow NULL."""
+  columns = get_columns(model)
+  changed = []
+  for name in names:
+    field = model._meta.get_field(name)
+    if field.null and not columns[field.column]:
+      old_field = copy.copy(field)
+      old_field.null = False
+      editor.alter_field(model, old_field, field)
+      changed.append(name)
+  return changed
+
+
+def has_index(model, fields, unique=False):
+  """Whether the table of model has an index over exactly fields."""
+  columns = [model._meta.get_field(name).column for name in fields]
+  for constraint in get_constraints(model).values():
+    if constraint['columns'] == columns and (
+        constraint['unique'] or (constraint['index'] and not unique)):
+      return True
+  return False
+
+
+def remove_duplicate_registrations():
+  """Keep only the newest registration of a user for an LBW."""
+  duplicates = UserRegistration.objects.values('user_id', 'lbw_id').annotate(
+      newest=Max('id'), registrations=Count('id')).filter(registrations__gt=1)
+  removed = 0
+  for duplicate in duplicates:
+    removed += duplicate['registrations'] - 1
+    UserRegistration.objects.filter(
+        user_id=duplicate['user_id'], lbw_id=duplicate['lbw_id']).exclude(
+            id=duplicate['newest']).delete()
+  return removed
+
+
+class Command(BaseCommand):
+  help = ('Add the columns, indexes and constraints the LBW models gained to '
+          'an existing database.  Run syncdb first to create new tables.')
+
+  def handle(self, *args, **options):
+    with connection.schema_editor() as editor:
+      for name in add_missing_fields(editor, Ride, ['ride_date']):
+        self.stdout.write('Added Ride.%s\n' % name)
+      # Open offers have no requester and open requests no offerer.
+      for name in make_nullable(editor, Ride, ['offerer', 'requester']):
+        self.stdout.write('Made Ride.%s optional\n' % name)
+      for model, names in ((Lbw, ['hidden', 'updated']),
+                           (Activity, ['cancelled', 'updated']),
+                           (UserRegistration, ['updated'])):
+        for name in add_missing_fields(editor, model, names):
+          self.stdout.write('Added %s.%s\n' % (model.__name__, name))
+      for model in (Activity, Message):
+        for fields in model._meta.index_together:
+          if not has_index(model, fields):
+            editor.alter_index_together(model, [], [fields])
+            self.stdout.write('Indexed %s%s\n' % (model.__name__, tuple(fields)))
+    # Deleting registrations loads them whole, so this has to wait until
+    # their new columns exist.
+    removed = remove_duplicate_registrations()
+    if removed:
+      self.stdout.write('Removed %d duplicate registrations\n' % removed)
+    with connection.schema_editor() as editor:
+      for fields in UserRegistration._meta.unique_together:
+        if not has_index(UserRegistration, fields, unique=True):
+          editor.alter_unique_together(UserRegistration, [], [fields])
+          self.stdout.write('Made UserRegistration%s unique\n' % (tuple(fields),))
+    # Rows from before 'updated' existed count as changed now, so conditional
+    # GETs cannot wrongly answer 304 for them.
+    now = timezone.now()
+    for model in (Lbw, Activity, UserRegistration):
+      backfilled = model.objects.filter(updated__isnull=True).update(updated=now)
+      if backfilled:
+        self.stdout.write('Set %s.updated on %d rows\n' % (model.__name__, backfilled))
@@ -0,0 +1,30 @@
+"""Middleware for LBW."""
+from django.conf import settings
+
+from registration import routers
+
+PIN_COOKIE = 'lbw_primary'
+# Seconds a user keeps reading from the primary after a POST, long enough
+# for the replica to catch up with what they just wrote.
+PIN_SECONDS = getattr(settings, 'LBW_PRIMARY_PIN_SECONDS', 10)
+
+
+class PrimaryPinningMiddleware(object):
+  """Give users read-your-writes on top of ReadReplicaRouter.
+
+  A POST, and every request within PIN_SECONDS of one (tracked with a signed
+  cookie), reads from the primary database.
+  """
+
+  def process_request(self, request):
+    pinned = (request.method == 'POST' or
+              request.get_signed_cookie(PIN_COOKIE, default=None,
+                                        max_age=PIN_SECONDS) is not None)
+    routers.pin_to_primary(pinned)
+
+  def process_response(self, request, response):
+    if request.method == 'POST':
+      response.set_signed_cookie(PIN_COOKIE, '1', max_age=PIN_SECONDS,
+                                 httponly=True)
+    routers.pin_to_primary(False)
+    return response
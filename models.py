@@ -1,5 +1,6 @@
 import collections
 import datetime
+import json
 
 from django.db import models
 from django.utils import timezone
@@ -26,6 +27,10 @@ class Lbw(models.Model):
     location = models.CharField(max_length=1001, blank=True)
     owners = models.ManyToManyField(LbwUser, blank=True, related_name='lbw_owners')
     lbw_url = models.CharField(max_length=1000, blank=True)
+    # Set when an owner deletes the LBW; purge_lbws removes it in the background.
+    hidden = models.BooleanField(default=False, editable=False)
+    # NULL only for rows from before the column existed, until upgrade_lbw_schema.
+    updated = models.DateTimeField(auto_now=True, null=True, editable=False)
 
     def timedelta(self):
       return self.start_date - timezone.now()
@@ -58,6 +63,12 @@ class Lbw(models.Model):
     def ScheduleMinutes(self):
       return xrange(0, 60, self.MIN_SCHEDULE_TIME)
 
+    def ScheduleChoicesJson(self):
+      return json.dumps({
+          'days': [day.strftime('%Y-%m-%d') for day in self.ScheduleDays()],
+          'hours': list(self.ScheduleHours()),
+          'minutes': list(self.ScheduleMinutes())})
+
     def GetMissingUsers(self):
       users = []
       for user_registration in self.userregistration_set.all():
@@ -97,12 +108,24 @@ class Lbw(models.Model):
         rc.setdefault(activity.activity_type, activity.get_activity_type_display())
       return rc
 
+    def LastChanged(self):
+      """When anything shown on this LBW's pages last changed."""
+      times = [self.updated]
+      for model in (Activity, UserRegistration, Message):
+        times.append(model.objects.filter(lbw=self).aggregate(
+            models.Max('updated'))['updated__max'])
+      times = [time for time in times if time]
+      if not times:
+        return None
+      return max(times)
+
     def __unicode__(self):
       return self.short_name
 
 class Activity(models.Model):
     class Meta:
         ordering = [ 'start_date' ]
+        index_together = [ ('lbw', 'start_date') ]
 
     ACTIVITY_TYPES = (
         (1, 'Workshop'),
@@ -137,6 +160,9 @@ class Activity(models.Model):
     lbw = models.ForeignKey(Lbw, editable=False, blank=True, null=True, related_name='activity')
     attachment = models.FileField(upload_to='attachments/', null=True)
     attachment_type = models.IntegerField(choices=ATTACHMENT_TYPE, default=3)
+    # Cancelled activities are detached from their LBW and removed by purge_lbws.
+    cancelled = models.BooleanField(default=False, editable=False)
+    updated = models.DateTimeField(auto_now=True, null=True, editable=False)
 
     def end_date(self):
       if self.start_date:
@@ -209,14 +235,21 @@ class Accommodation(models.Model):
       return ' - '.join([self.get_kind_display(), self.name])
 
 class UserRegistration(models.Model):
+    class Meta:
+        unique_together = [ ('user', 'lbw') ]
+
     user = models.ForeignKey(User)
     lbw = models.ForeignKey(Lbw)
     arrival_date = models.DateTimeField(help_text="Format: YYYY-MMM-DD HH:MM:SS")
     departure_date = models.DateTimeField(help_text="Format: YYYY-MMM-DD HH:MM:SS")
     accommodation = models.ForeignKey(Accommodation, blank=True, null=True)
     children = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True, null=True, editable=False)
 
 class Message(models.Model):
+    class Meta:
+        index_together = [ ('lbw', 'activity') ]
+
     activity = models.ForeignKey(Activity, blank=True, null=True, editable=False)
     lbw = models.ForeignKey(Lbw, blank=True, null=True, editable=False)
     next = models.ForeignKey('self', blank=True, null=True, editable=False, related_name='next_message')
@@ -233,13 +266,42 @@ class Message(models.Model):
     def __unicode__(self):
       return self.subject
     
+class ChunkedUpload(models.Model):
+    user = models.ForeignKey(User)
+    filename = models.CharField(max_length=1001, blank=True)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    # Storage name of the content addressed file, once the upload is complete.
+    blob = models.CharField(max_length=1001, blank=True)
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+
+    def finished(self):
+      return bool(self.blob)
+
+    def __unicode__(self):
+      return self.filename
+
 class Ride(models.Model):
     ride_from = models.CharField(max_length=1001)
     ride_to = models.CharField(max_length=1001)
-    offerer = models.ForeignKey(User, related_name='ride_offerer')
-    requester = models.ForeignKey(User, related_name='ride_requester')
-    notes = models.CharField(max_length=1001)
-    lbw = models.ForeignKey(Lbw)
+    ride_date = models.DateTimeField(blank=True, null=True,
+                                     help_text="Format: YYYY-MMM-DD HH:MM:SS. Leave empty to use your arrival/departure.")
+    offerer = models.ForeignKey(User, blank=True, null=True, editable=False, related_name='ride_offerer')
+    requester = models.ForeignKey(User, blank=True, null=True, editable=False, related_name='ride_requester')
+    notes = models.CharField(max_length=1001, blank=True)
+    lbw = models.ForeignKey(Lbw, editable=False)
+
+    def IsOffer(self):
+      return self.offerer_id is not None and self.requester_id is None
+
+    def IsRequest(self):
+      return self.requester_id is not None and self.offerer_id is None
+
+    def IsMatched(self):
+      return self.offerer_id is not None and self.requester_id is not None
+
+    def __unicode__(self):
+      return '%s -> %s' % (self.ride_from, self.ride_to)
     
 class Tshirt(models.Model):
     name = models.CharField(max_length=1001)
@@ -0,0 +1,95 @@
+"""Deletion of hidden LBWs and cancelled activities in bounded batches.
+
+Letting Django cascade the delete of a big LBW loads every dependent row
+into memory and holds locks for the whole time.  Instead the views only
+mark things as gone, and purge_lbws deletes the rows table by table with
+plain DELETE statements of at most BATCH_SIZE rows per transaction.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db import transaction
+
+from registration.models import Accommodation
+from registration.models import Activity
+from registration.models import Lbw
+from registration.models import Message
+from registration.models import Ride
+from registration.models import Tshirt
+from registration.models import TshirtOrders
+from registration.models import UserRegistration
+
+# Every id in a batch is a bound parameter, and SQLite before 3.32 allows
+# at most 999 of them in one statement.
+BATCH_SIZE = getattr(settings, 'LBW_PURGE_BATCH_SIZE', 900)
+
+
+def get_table(model):
+  return connection.ops.quote_name(model._meta.db_table)
+
+
+def delete_in_batches(model, where, params, self_references=()):
+  """Delete the rows of model matching the SQL condition where.
+
+  self_references are columns of the same table pointing at its own rows;
+  they are cleared first so a batch never deletes a row another row still
+  refers to.  Returns the number of rows deleted.
+  """
+  table = get_table(model)
+  deleted = 0
+  while True:
+    with transaction.atomic():
+      cursor = connection.cursor()
+      cursor.execute('SELECT id FROM %s WHERE %s LIMIT %d'
+                     % (table, where, BATCH_SIZE), params)
+      ids = [row[0] for row in cursor.fetchall()]
+      if not ids:
+        return deleted
+      placeholders = ', '.join(['%s'] * len(ids))
+      for column in self_references:
+        cursor.execute('UPDATE %s SET %s = NULL WHERE %s IN (%s)'
+                       % (table, column, column, placeholders), ids)
+      cursor.execute('DELETE FROM %s WHERE id IN (%s)'
+                     % (table, placeholders), ids)
+      deleted += len(ids)
+
+
+def purge_activity(activity_id):
+  """Delete an activity together with its messages and attendee lists."""
+  deleted = delete_in_batches(Message, 'activity_id = %s', [activity_id],
+                              self_references=('next_id', 'previous_id'))
+  deleted += delete_in_batches(Activity.attendees.through, 'activity_id = %s',
+                               [activity_id])
+  deleted += delete_in_batches(Activity.owners.through, 'activity_id = %s',
+                               [activity_id])
+  deleted += delete_in_batches(Activity, 'id = %s', [activity_id])
+  return deleted
+
+
+def purge_lbw(lbw_id):
+  """Delete an LBW and everything that belongs to it."""
+  activities = 'activity_id IN (SELECT id FROM %s WHERE lbw_id = %%s)' % get_table(Activity)
+  tshirts = 'tshirt_id IN (SELECT id FROM %s WHERE lbw_id = %%s)' % get_table(Tshirt)
+  deleted = delete_in_batches(Message, 'lbw_id = %s OR ' + activities,
+                              [lbw_id, lbw_id],
+                              self_references=('next_id', 'previous_id'))
+  deleted += delete_in_batches(Activity.attendees.through, activities, [lbw_id])
+  deleted += delete_in_batches(Activity.owners.through, activities, [lbw_id])
+  deleted += delete_in_batches(UserRegistration, 'lbw_id = %s', [lbw_id])
+  deleted += delete_in_batches(Ride, 'lbw_id = %s', [lbw_id])
+  deleted += delete_in_batches(TshirtOrders, tshirts, [lbw_id])
+  for model in (Tshirt, Accommodation, Activity, Lbw.owners.through):
+    deleted += delete_in_batches(model, 'lbw_id = %s', [lbw_id])
+  deleted += delete_in_batches(Lbw, 'id = %s', [lbw_id])
+  return deleted
+
+
+def get_remaining(lbw_id):
+  """How many rows of a hidden LBW are still waiting to be deleted."""
+  return [
+      ('Activities', Activity.objects.filter(lbw_id=lbw_id).count()),
+      ('Messages', Message.objects.filter(lbw_id=lbw_id).count()),
+      ('Registrations', UserRegistration.objects.filter(lbw_id=lbw_id).count()),
+      ('Accommodation', Accommodation.objects.filter(lbw_id=lbw_id).count()),
+      ('Rides', Ride.objects.filter(lbw_id=lbw_id).count()),
+      ('T-shirts', Tshirt.objects.filter(lbw_id=lbw_id).count()),
+  ]
@@ -0,0 +1,122 @@
+"""Ride sharing matcher for LBWs."""
+import collections
+import datetime
+import re
+import unicodedata
+
+from django.db.models import Q
+
+from registration.models import Ride
+from registration.models import UserRegistration
+
+# How many days either side of a request's travel date an offer may be.
+RIDE_DATE_TOLERANCE = 1
+
+_NON_WORD = re.compile(r'\W+', re.UNICODE)
+
+
+def normalize_place(place):
+  """Reduce a free-text place name to a key: lower case, no accents or punctuation."""
+  if not place:
+    return u''
+  place = unicodedata.normalize('NFKD', unicode(place))
+  place = u''.join(c for c in place if not unicodedata.combining(c))
+  return u' '.join(word for word in _NON_WORD.split(place.lower()) if word)
+
+
+def is_lbw_place(place, lbw_place):
+  """Whether a place names the LBW location.
+
+  Either may be the more specific one, so "Bad Tolz" is the LBW at
+  "Bad Tolz, Bavaria" and "Bad Tolz, Bavaria" is the LBW at "Bad Tolz".
+  """
+  words = set(normalize_place(place).split())
+  lbw_words = set(lbw_place.split())
+  return bool(words and lbw_words) and (words <= lbw_words or lbw_words <= words)
+
+
+def get_travel_date(ride, user_registration, lbw_place):
+  """Work out the day a ride happens.
+
+  An explicit ride_date wins.  Otherwise rides to the LBW location happen
+  on the arrival date of the registration, and everything else on the
+  departure date.
+  """
+  if ride.ride_date:
+    return ride.ride_date.date()
+  if not user_registration:
+    return None
+  if is_lbw_place(ride.ride_to, lbw_place):
+    return user_registration.arrival_date.date()
+  return user_registration.departure_date.date()
+
+
+def get_ride_key(ride, user_registration, lbw_place):
+  """The (from, to, day) key a ride is indexed under."""
+  return (normalize_place(ride.ride_from), normalize_place(ride.ride_to),
+          get_travel_date(ride, user_registration, lbw_place))
+
+
+def get_nearby_days(day):
+  """All the day buckets an offer for a request on day may be in."""
+  if day is None:
+    return [None]
+  return [day + datetime.timedelta(days=d)
+          for d in xrange(-RIDE_DATE_TOLERANCE, RIDE_DATE_TOLERANCE + 1)] + [None]
+
+
+def match_rides(lbw):
+  """Pair the open ride requests of an LBW with the open offers.
+
+  Offers are bucketed by (from, to, day), so every request only looks at the
+  few buckets around its travel date rather than at every offer.  Offers
+  without a known date sit in the None bucket and are candidates for every
+  request on the same route.
+
+  Returns a tuple (matches, offers): matches is a list of
+  (request, [offers]) and offers is the list of all open offers.
+  """
+  lbw_place = normalize_place(lbw.location)
+  registrations = dict(
+      (user_registration.user_id, user_registration)
+      for user_registration in UserRegistration.objects.filter(lbw=lbw))
+  open_rides = Ride.objects.filter(lbw=lbw).filter(
+      Q(offerer__isnull=True) | Q(requester__isnull=True)).select_related(
+          'offerer', 'requester').order_by('ride_date', 'id')
+
+  index = collections.defaultdict(list)
+  offers = []
+  requests = []
+  for ride in open_rides:
+    if ride.IsOffer():
+      key = get_ride_key(ride, registrations.get(ride.offerer_id), lbw_place)
+      index[key].append(ride)
+      offers.append(ride)
+    elif ride.IsRequest():
+      requests.append(ride)
+
+  matches = []
+  for ride in requests:
+    place_from, place_to, day = get_ride_key(
+        ride, registrations.get(ride.requester_id), lbw_place)
+    candidates = []
+    for bucket in get_nearby_days(day):
+      candidates.extend(offer for offer in index.get((place_from, place_to, bucket), [])
+                        if offer.offerer_id != ride.requester_id)
+    matches.append((ride, candidates))
+  return matches, offers
+
+
+def is_candidate(lbw, offer, ride_request):
+  """Whether match_rides would list offer as a candidate for ride_request."""
+  if offer.offerer_id == ride_request.requester_id:
+    return False
+  lbw_place = normalize_place(lbw.location)
+  registrations = dict(
+      (user_registration.user_id, user_registration)
+      for user_registration in UserRegistration.objects.filter(
+          lbw=lbw, user_id__in=[offer.offerer_id, ride_request.requester_id]))
+  place_from, place_to, day = get_ride_key(
+      ride_request, registrations.get(ride_request.requester_id), lbw_place)
+  return get_ride_key(offer, registrations.get(offer.offerer_id), lbw_place) in [
+      (place_from, place_to, bucket) for bucket in get_nearby_days(day)]
@@ -0,0 +1,44 @@
+"""Database routing for LBW: reads go to a replica, writes to the primary."""
+import threading
+
+from django.conf import settings
+
+# Database alias reads are sent to, if it is configured in DATABASES.
+READ_REPLICA = getattr(settings, 'LBW_READ_REPLICA', 'replica')
+PRIMARY = 'default'
+
+_state = threading.local()
+
+
+def pin_to_primary(pinned=True):
+  """Send all reads of the current thread to the primary."""
+  _state.pinned = pinned
+
+
+def is_pinned_to_primary():
+  return getattr(_state, 'pinned', False)
+
+
+class ReadReplicaRouter(object):
+  """Route reads to LBW_READ_REPLICA unless the request is pinned to the primary.
+
+  Enable with DATABASE_ROUTERS = ['registration.routers.ReadReplicaRouter']
+  together with registration.middleware.PrimaryPinningMiddleware.
+  """
+
+  def db_for_read(self, model, **hints):
+    if is_pinned_to_primary() or READ_REPLICA not in settings.DATABASES:
+      return PRIMARY
+    return READ_REPLICA
+
+  def db_for_write(self, model, **hints):
+    return PRIMARY
+
+  def allow_relation(self, obj1, obj2, **hints):
+    # Both aliases hold the same data.
+    return True
+
+  def allow_migrate(self, db, *args, **hints):
+    return db == PRIMARY
+
+  allow_syncdb = allow_migrate
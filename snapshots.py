@@ -0,0 +1,98 @@
+"""Frozen copies of the public pages of finished LBWs."""
+import functools
+import logging
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+
+from registration.models import Lbw
+
+logger = logging.getLogger(__name__)
+
+# Kept out of MEDIA_ROOT: details.json is only for logged-in users.
+SNAPSHOT_DIR = getattr(settings, 'LBW_SNAPSHOT_DIR',
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'snapshots'))
+
+
+def get_snapshot_dir(lbw_id):
+  return os.path.join(SNAPSHOT_DIR, '%d' % int(lbw_id))
+
+
+def read_snapshot(lbw_id, page):
+  """Return the frozen content of a page, or None if there is none."""
+  try:
+    with open(os.path.join(get_snapshot_dir(lbw_id), page), 'rb') as snapshot:
+      return snapshot.read()
+  except IOError:
+    return None
+
+
+def write_snapshot(lbw_id, page, content):
+  """Freeze a page.  The file is renamed into place so readers never see half of it.
+
+  Returns whether the snapshot was written.  A snapshot directory that
+  cannot be written, e.g. on a read-only deploy, only costs the speedup, so
+  the failure is logged rather than raised.
+  """
+  directory = get_snapshot_dir(lbw_id)
+  path = None
+  try:
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    handle, path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(handle, 'wb') as snapshot:
+      snapshot.write(content)
+    os.rename(path, os.path.join(directory, page))
+  except (IOError, OSError):
+    logger.exception('Cannot freeze %s of LBW %s', page, lbw_id)
+    if path and os.path.exists(path):
+      os.remove(path)
+    return False
+  return True
+
+
+def thaw_lbw(lbw_id):
+  """Throw away the snapshots of an LBW after it was edited."""
+  shutil.rmtree(get_snapshot_dir(lbw_id), ignore_errors=True)
+
+
+def thaw_all():
+  """Throw away every snapshot, e.g. when the list of LBWs in the sidebar changes."""
+  shutil.rmtree(SNAPSHOT_DIR, ignore_errors=True)
+
+
+def get_snapshot_response(content, page):
+  if page.endswith('.json'):
+    return HttpResponse(content, content_type="application/json")
+  return HttpResponse(content)
+
+
+def frozen(page):
+  """Serve a view to anonymous users from the LBW's snapshot once it is finished.
+
+  page is the snapshot file name, formatted with the view's keyword
+  arguments.  The first anonymous GET after the LBW ended renders the page
+  as usual and freezes it.  Put it above any decorator that queries the
+  database, so serving a snapshot needs no queries at all.
+  """
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(request, lbw_id, **kwargs):
+      if request.method != 'GET' or request.user.is_authenticated():
+        return view(request, lbw_id, **kwargs)
+      name = page % kwargs
+      content = read_snapshot(lbw_id, name)
+      if content is not None:
+        return get_snapshot_response(content, name)
+      response = view(request, lbw_id, **kwargs)
+      if (response.status_code == 200 and
+          Lbw.objects.filter(pk=lbw_id, end_date__lt=timezone.now()).exists()):
+        write_snapshot(lbw_id, name, response.content)
+      return response
+    return wrapper
+  return decorator
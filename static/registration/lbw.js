@@ -92,11 +92,144 @@ $(function() {
 });
 
 
+function BuildScheduleSelect(name, values) {
+  var select = $('<select/>', {name: name});
+  select.append($('<option/>', {value: '', text: 'Unsched.'}));
+  $.each(values, function(i, value) {
+    select.append($('<option/>', {value: value, text: value}));
+  });
+  return select;
+}
+
+function SetupSchedulePickers() {
+  // The day/hour/minute choices are sent once per page in #schedule_choices;
+  // each .schedule_picker only carries the activity's current value.
+  var blob = $('#schedule_choices');
+  if (!blob.length) {
+    return;
+  }
+  var choices = $.parseJSON(blob.text());
+  var days = BuildScheduleSelect('activity_day', choices.days);
+  var hours = BuildScheduleSelect('activity_hour', choices.hours);
+  var minutes = BuildScheduleSelect('activity_min', choices.minutes);
+  $('.schedule_picker').each(function() {
+    var picker = $(this);
+    var day = picker.attr('data-day');
+    var hour = picker.attr('data-hour');
+    var minute = picker.attr('data-minute');
+    var day_select = days.clone();
+    if (day && $.inArray(day, choices.days) < 0) {
+      day_select.children().first().after($('<option/>', {value: day, text: day}));
+    }
+    day_select.val(day);
+    var hour_select = hours.clone().val(hour);
+    var minute_select = minutes.clone().val(
+        minute ? String(parseInt(minute, 10)) : '');
+    picker.append($('<label/>').append(day_select), ' ',
+                  $('<label/>').append(hour_select), ':',
+                  $('<label/>').append(minute_select), ' ');
+  });
+}
+
+var UPLOAD_CHUNK_SIZE = 1024 * 1024;
+
+function SendUploadChunks(file, status, done, failed) {
+  // Send file from status.received onwards, one chunk per request.
+  if (status.finished) {
+    done(status);
+    return;
+  }
+  var end = Math.min(status.received + UPLOAD_CHUNK_SIZE, file.size);
+  $.ajax({
+    type: 'POST',
+    url: status.url + '?offset=' + status.received,
+    data: file.slice(status.received, end),
+    processData: false,
+    contentType: 'application/octet-stream',
+    headers: {'X-CSRFToken': document.getElementsByName('csrfmiddlewaretoken')[0].value},
+    success: function(next_status) {
+      SendUploadChunks(file, next_status, done, failed);
+    },
+    error: failed
+  });
+}
+
+function ChunkedUpload(start_url, file, done, failed) {
+  // Resume the upload of the same file if an earlier attempt was cut off.
+  var key = 'lbw_upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+  var upload_url = window.localStorage && localStorage.getItem(key);
+  var finished = function(status) {
+    if (window.localStorage) {
+      localStorage.removeItem(key);
+    }
+    done(status);
+  };
+  var start = function() {
+    $.ajax({
+      type: 'POST',
+      url: start_url,
+      data: {
+        csrfmiddlewaretoken: document.getElementsByName('csrfmiddlewaretoken')[0].value,
+        filename: file.name,
+        size: file.size
+      },
+      success: function(status) {
+        if (window.localStorage) {
+          localStorage.setItem(key, status.url);
+        }
+        SendUploadChunks(file, status, finished, failed);
+      },
+      error: failed
+    });
+  };
+  if (!upload_url) {
+    start();
+    return;
+  }
+  $.ajax({
+    type: 'GET',
+    url: upload_url,
+    success: function(status) {
+      SendUploadChunks(file, status, finished, failed);
+    },
+    error: start
+  });
+}
+
+function SetupChunkedUploads() {
+  if (!window.File || !File.prototype.slice) {
+    return;
+  }
+  $(".chunked_upload").each(function() {
+    var start_url = $(this).attr('data-url');
+    $(this).find("form").submit(function(event) {
+      var form = this;
+      var input = $(form).find("input[type=file][name=attachment]");
+      if (!input.length || !input[0].files.length) {
+        return true;
+      }
+      event.preventDefault();
+      $(form).find("input[type=submit]").prop('disabled', true);
+      ChunkedUpload(start_url, input[0].files[0], function(status) {
+        $(form).find("input[name=attachment_upload]").val(status.upload_id);
+        input.val('');
+        form.submit();
+      }, function(xhr, textStatus, errorThrown) {
+        $(form).find("input[type=submit]").prop('disabled', false);
+        alert("Upload interrupted, submit again to resume: " + textStatus);
+      });
+      return false;
+    });
+  });
+}
+
 function setupHandlers() {
 	SetupShowMessageHandlers();
 	SetupShowConfirmDeleteMessageHandlers();
 	SetupHideConfirmDeleteMessageHandlers();
 	SetupDeleteHandlers();
+	SetupSchedulePickers();
+	SetupChunkedUploads();
 }
 
 
@@ -0,0 +1,539 @@
+"""Tests for LBW."""
+import datetime
+import hashlib
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db import connections
+from django.http import HttpResponse
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import baseconv
+from django.utils import timezone
+
+from registration.models import Accommodation
+from registration.models import Activity
+from registration.models import ChunkedUpload
+from registration.models import Lbw
+from registration.models import Message
+from registration.models import Ride
+from registration.models import Tshirt
+from registration.models import TshirtOrders
+from registration.models import UserRegistration
+from registration import purge
+from registration import routers
+from registration.agenda import find_overlaps
+from registration import uploads
+from registration.middleware import PIN_COOKIE
+from registration.middleware import PIN_SECONDS
+from registration.middleware import PrimaryPinningMiddleware
+from registration.rides import is_candidate
+from registration.rides import match_rides
+from registration.rides import normalize_place
+
+# Attendees in the ride matching benchmark; half offer a ride, half ask for one.
+RIDE_BENCHMARK_ATTENDEES = 4000
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite only')
+class HotLookupIndexTest(TestCase):
+  """The lookups the views do on every page use their composite indexes."""
+
+  def assertUsesIndex(self, queryset, fields):
+    model = queryset.model
+    table = model._meta.db_table
+    columns = [model._meta.get_field(name).column for name in fields]
+    cursor = connection.cursor()
+    sql, params = queryset.query.sql_with_params()
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    plan = ' / '.join(row[-1] for row in cursor.fetchall())
+    indexes = [name for name, constraint in
+               connection.introspection.get_constraints(cursor, table).items()
+               if constraint['columns'] == columns and
+               (constraint['index'] or constraint['unique'])]
+    self.assertTrue(indexes, 'No index on %s%s' % (table, tuple(columns)))
+    self.assertTrue(any(name in plan for name in indexes), plan)
+    self.assertFalse(re.search(r'\bSCAN (TABLE )?%s\b' % table, plan), plan)
+
+  def test_activity_lbw_start_date(self):
+    start_date = timezone.now()
+    self.assertUsesIndex(
+        Activity.objects.filter(
+            lbw_id=1, start_date__range=(start_date,
+                                         start_date + datetime.timedelta(days=1))),
+        ('lbw', 'start_date'))
+
+  def test_user_registration_user_lbw(self):
+    self.assertUsesIndex(
+        UserRegistration.objects.filter(user__exact=1, lbw__exact=1),
+        ('user', 'lbw'))
+
+  def test_message_lbw_activity(self):
+    self.assertUsesIndex(
+        Message.objects.filter(lbw_id=1).filter(activity=None),
+        ('lbw', 'activity'))
+    self.assertUsesIndex(
+        Message.objects.filter(lbw_id=1, activity_id=1),
+        ('lbw', 'activity'))
+
+
+class RideMatchingTest(TestCase):
+  """match_rides pairs requests with offers on the same route and days."""
+
+  def setUp(self):
+    self.start_date = timezone.now()
+    self.lbw = Lbw.objects.create(
+        short_name='Test', description='Test', location=u'Bad T\xf6lz',
+        start_date=self.start_date,
+        end_date=self.start_date + datetime.timedelta(days=7))
+
+  def create_users(self, count):
+    User.objects.bulk_create(
+        [User(username='rider%d' % i) for i in xrange(count)])
+    return list(User.objects.filter(username__startswith='rider').order_by('id'))
+
+  def test_normalize_place(self):
+    self.assertEqual(normalize_place(u'  Bad T\xf6lz! '), u'bad tolz')
+    self.assertEqual(normalize_place(u'M\xfcnchen-Hbf'), u'munchen hbf')
+    self.assertEqual(normalize_place(None), u'')
+
+  def test_match_rides(self):
+    offerer, requester, other = self.create_users(3)
+    day = self.start_date + datetime.timedelta(days=1)
+    offer = Ride.objects.create(lbw=self.lbw, offerer=offerer, ride_date=day,
+                                ride_from='Munich Hbf', ride_to=u'Bad T\xf6lz')
+    Ride.objects.create(lbw=self.lbw, offerer=offerer,
+                        ride_date=day + datetime.timedelta(days=5),
+                        ride_from='Munich Hbf', ride_to=u'Bad T\xf6lz')
+    ride_request = Ride.objects.create(
+        lbw=self.lbw, requester=requester,
+        ride_date=day + datetime.timedelta(days=1),
+        ride_from='munich hbf.', ride_to='bad tolz')
+    elsewhere = Ride.objects.create(lbw=self.lbw, requester=other, ride_date=day,
+                                    ride_from='Salzburg', ride_to='Bad Tolz')
+    matches, offers = match_rides(self.lbw)
+    self.assertEqual(len(offers), 2)
+    self.assertEqual(dict((ride.id, [o.id for o in candidates])
+                          for ride, candidates in matches),
+                     {ride_request.id: [offer.id], elsewhere.id: []})
+
+  def test_match_rides_uses_registration_dates(self):
+    offerer, requester = self.create_users(2)
+    arrival = self.start_date
+    for user in (offerer, requester):
+      UserRegistration.objects.create(
+          user=user, lbw=self.lbw, arrival_date=arrival,
+          departure_date=arrival + datetime.timedelta(days=7))
+    offer = Ride.objects.create(lbw=self.lbw, offerer=offerer,
+                                ride_from='Munich', ride_to=u'Bad T\xf6lz')
+    Ride.objects.create(lbw=self.lbw, requester=requester,
+                        ride_from=u'Bad T\xf6lz', ride_to='Munich')
+    ride_request = Ride.objects.create(lbw=self.lbw, requester=requester,
+                                       ride_from='Munich', ride_to=u'Bad T\xf6lz')
+    matches, _ = match_rides(self.lbw)
+    self.assertEqual(dict((ride.id, [o.id for o in candidates])
+                          for ride, candidates in matches)[ride_request.id],
+                     [offer.id])
+
+  def test_rides_leaving_a_longer_location_use_departure(self):
+    self.lbw.location = u'Bad T\xf6lz, Bavaria'
+    self.lbw.save()
+    offerer, requester = self.create_users(2)
+    for user in (offerer, requester):
+      UserRegistration.objects.create(
+          user=user, lbw=self.lbw, arrival_date=self.start_date,
+          departure_date=self.start_date + datetime.timedelta(days=7))
+    offer = Ride.objects.create(lbw=self.lbw, offerer=offerer,
+                                ride_date=self.start_date + datetime.timedelta(days=7),
+                                ride_from=u'Bad T\xf6lz', ride_to='Munich')
+    ride_request = Ride.objects.create(lbw=self.lbw, requester=requester,
+                                       ride_from=u'Bad T\xf6lz', ride_to='Munich')
+    matches, _ = match_rides(self.lbw)
+    self.assertEqual([(ride.id, [o.id for o in candidates])
+                      for ride, candidates in matches],
+                     [(ride_request.id, [offer.id])])
+    self.assertTrue(is_candidate(self.lbw, offer, ride_request))
+
+  def test_is_candidate(self):
+    offerer, requester = self.create_users(2)
+    day = self.start_date + datetime.timedelta(days=1)
+    offer = Ride.objects.create(lbw=self.lbw, offerer=offerer, ride_date=day,
+                                ride_from='Munich', ride_to=u'Bad T\xf6lz')
+    near = Ride.objects.create(lbw=self.lbw, requester=requester,
+                               ride_date=day + datetime.timedelta(days=1),
+                               ride_from='Munich', ride_to=u'Bad T\xf6lz')
+    late = Ride.objects.create(lbw=self.lbw, requester=requester,
+                               ride_date=day + datetime.timedelta(days=2),
+                               ride_from='Munich', ride_to=u'Bad T\xf6lz')
+    elsewhere = Ride.objects.create(lbw=self.lbw, requester=requester,
+                                    ride_date=day, ride_from='Salzburg',
+                                    ride_to=u'Bad T\xf6lz')
+    own = Ride.objects.create(lbw=self.lbw, requester=offerer, ride_date=day,
+                              ride_from='Munich', ride_to=u'Bad T\xf6lz')
+    self.assertTrue(is_candidate(self.lbw, offer, near))
+    self.assertFalse(is_candidate(self.lbw, offer, late))
+    self.assertFalse(is_candidate(self.lbw, offer, elsewhere))
+    self.assertFalse(is_candidate(self.lbw, offer, own))
+
+  def test_accept_rejects_offers_that_do_not_match(self):
+    offerer, requester = self.create_users(2)
+    requester.set_password('secret')
+    requester.save()
+    offer = Ride.objects.create(lbw=self.lbw, offerer=offerer,
+                                ride_date=self.start_date,
+                                ride_from='Munich', ride_to=u'Bad T\xf6lz')
+    ride_request = Ride.objects.create(lbw=self.lbw, requester=requester,
+                                       ride_date=self.start_date,
+                                       ride_from='Salzburg', ride_to=u'Bad T\xf6lz')
+    self.assertTrue(self.client.login(username=requester.username, password='secret'))
+    response = self.client.post(
+        reverse('registration:rides', args=(self.lbw.id,)),
+        {'submit': 'Accept', 'offer_id': offer.id, 'request_id': ride_request.id})
+    self.assertEqual(response.status_code, 400)
+    self.assertIsNone(Ride.objects.get(pk=offer.id).requester_id)
+    self.assertTrue(Ride.objects.filter(pk=ride_request.id).exists())
+
+  def test_benchmark(self):
+    """Match rides for every attendee of a big LBW, and report the time taken."""
+    users = self.create_users(RIDE_BENCHMARK_ATTENDEES)
+    places = ['City %d' % i for i in xrange(50)]
+    registrations = []
+    rides = []
+    for i, user in enumerate(users):
+      arrival = self.start_date + datetime.timedelta(days=i % 7)
+      registrations.append(UserRegistration(
+          user=user, lbw=self.lbw, arrival_date=arrival,
+          departure_date=self.start_date + datetime.timedelta(days=7)))
+      # Each request shares its route with the offer created after it.
+      ride = Ride(lbw=self.lbw, ride_from=places[(i // 2) % len(places)],
+                  ride_to=self.lbw.location)
+      if i % 2:
+        ride.offerer = user
+      else:
+        ride.requester = user
+      rides.append(ride)
+    UserRegistration.objects.bulk_create(registrations)
+    Ride.objects.bulk_create(rides)
+
+    started = time.time()
+    with self.assertNumQueries(2):
+      matches, offers = match_rides(self.lbw)
+    elapsed = time.time() - started
+    self.assertEqual(len(offers), RIDE_BENCHMARK_ATTENDEES / 2)
+    self.assertEqual(len(matches), RIDE_BENCHMARK_ATTENDEES / 2)
+    self.assertTrue(all(candidates for _, candidates in matches))
+    sys.stderr.write('\nmatch_rides: %d offers, %d requests in %.3fs\n'
+                     % (len(offers), len(matches), elapsed))
+
+
+class PurgeLbwTest(TestCase):
+  """purge_lbw removes every row of an LBW in small batches and leaves no dangling keys."""
+
+  def setUp(self):
+    self.batch_size = purge.BATCH_SIZE
+    purge.BATCH_SIZE = 2
+    self.users = [User.objects.create(username='user%d' % i) for i in xrange(3)]
+    self.lbw = self.create_lbw('Purged')
+    self.other_lbw = self.create_lbw('Kept')
+
+  def tearDown(self):
+    purge.BATCH_SIZE = self.batch_size
+
+  def create_lbw(self, name):
+    start_date = timezone.now()
+    lbw = Lbw.objects.create(short_name=name, description=name, location=name,
+                             start_date=start_date,
+                             end_date=start_date + datetime.timedelta(days=7))
+    accommodation = Accommodation.objects.create(lbw=lbw, kind=1, name=name)
+    for user in self.users:
+      UserRegistration.objects.create(
+          user=user, lbw=lbw, accommodation=accommodation,
+          arrival_date=start_date, departure_date=lbw.end_date)
+    tshirt = Tshirt.objects.create(lbw=lbw, name=name, picture='', price=10)
+    for user in self.users:
+      TshirtOrders.objects.create(tshirt=tshirt, user=user, quantity=1, size='M - M')
+    Ride.objects.create(lbw=lbw, offerer=self.users[0], ride_from='A', ride_to=name)
+    activities = []
+    for i in xrange(3):
+      activity = Activity.objects.create(lbw=lbw, short_name='%s %d' % (name, i),
+                                         description=name, start_date=start_date)
+      activity.attendees.add(*self.users)
+      activities.append(activity)
+    # A thread of replies across the LBW and its activities.
+    previous = None
+    for i in xrange(5):
+      message = Message.objects.create(
+          lbw=lbw if i % 2 else None,
+          activity=None if i % 2 else activities[i % 3],
+          writer=self.users[i % 3], subject=name, message=name,
+          previous=previous)
+      if previous:
+        Message.objects.filter(pk=previous.id).update(next=message)
+      previous = message
+    return lbw
+
+  def assertNoDanglingKeys(self):
+    lbws = Lbw.objects.values('id')
+    activities = Activity.objects.values('id')
+    messages = Message.objects.values('id')
+    self.assertFalse(Message.objects.exclude(next=None).exclude(next_id__in=messages))
+    self.assertFalse(Message.objects.exclude(previous=None).exclude(
+        previous_id__in=messages))
+    self.assertFalse(Message.objects.exclude(lbw=None).exclude(lbw_id__in=lbws))
+    self.assertFalse(Message.objects.exclude(activity=None).exclude(
+        activity_id__in=activities))
+    self.assertFalse(Activity.attendees.through.objects.exclude(
+        activity_id__in=activities))
+    self.assertFalse(Activity.objects.exclude(lbw=None).exclude(lbw_id__in=lbws))
+    self.assertFalse(TshirtOrders.objects.exclude(tshirt_id__in=Tshirt.objects.values('id')))
+    for model in (UserRegistration, Accommodation, Tshirt, Ride):
+      self.assertFalse(model.objects.exclude(lbw_id__in=lbws))
+
+  def count_rows(self):
+    return dict((model.__name__, model.objects.count()) for model in
+                (Lbw, Activity, Activity.attendees.through, Message,
+                 UserRegistration, Accommodation, Tshirt, TshirtOrders, Ride))
+
+  def test_purge_lbw(self):
+    # The other LBW's first message replies to this LBW's last one.
+    last = Message.objects.filter(lbw=self.lbw).order_by('-id')[0]
+    Message.objects.filter(subject='Kept', previous=None).update(previous=last)
+    before = self.count_rows()
+    deleted = purge.purge_lbw(self.lbw.id)
+    after = self.count_rows()
+    self.assertEqual(deleted, sum(before.values()) - sum(after.values()))
+    self.assertEqual(after, dict((name, count / 2) for name, count in before.items()))
+    self.assertFalse(Lbw.objects.filter(pk=self.lbw.id).exists())
+    self.assertTrue(all(count == 0 for _, count in purge.get_remaining(self.lbw.id)))
+    self.assertNoDanglingKeys()
+    self.assertEqual(Message.objects.filter(subject='Kept').count(), 5)
+
+
+class FindOverlapsTest(SimpleTestCase):
+  """find_overlaps reports every pair of activities running at the same time."""
+
+  def setUp(self):
+    self.start_date = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+  def make_activity(self, activity_id, start_minutes, duration):
+    start_date = None
+    if start_minutes is not None:
+      start_date = self.start_date + datetime.timedelta(minutes=start_minutes)
+    return Activity(id=activity_id, short_name='Activity %d' % activity_id,
+                    start_date=start_date, duration=duration)
+
+  def get_overlaps(self, *activities):
+    return sorted((first.id, second.id)
+                  for first, second in find_overlaps(activities))
+
+  def test_back_to_back(self):
+    self.assertEqual(self.get_overlaps(self.make_activity(1, 0, 60),
+                                       self.make_activity(2, 60, 60)), [])
+
+  def test_nested(self):
+    self.assertEqual(self.get_overlaps(self.make_activity(1, 0, 180),
+                                       self.make_activity(2, 30, 30),
+                                       self.make_activity(3, 90, 30)),
+                     [(1, 2), (1, 3)])
+
+  def test_unscheduled(self):
+    self.assertEqual(self.get_overlaps(self.make_activity(1, None, 60),
+                                       self.make_activity(2, 0, 60),
+                                       self.make_activity(3, None, 60)), [])
+
+  def test_chain(self):
+    # 1 overlaps 2 and 2 overlaps 3, but 1 has ended when 3 starts.
+    self.assertEqual(self.get_overlaps(self.make_activity(1, 0, 60),
+                                       self.make_activity(2, 30, 60),
+                                       self.make_activity(3, 60, 60)),
+                     [(1, 2), (2, 3)])
+    self.assertEqual(self.get_overlaps(self.make_activity(1, 0, 90),
+                                       self.make_activity(2, 30, 90),
+                                       self.make_activity(3, 60, 90)),
+                     [(1, 2), (1, 3), (2, 3)])
+
+
+class RacingStorage(FileSystemStorage):
+  """Storage whose first exists() misses, as if another request saved just after."""
+  racing = True
+
+  def exists(self, name):
+    if self.racing:
+      self.racing = False
+      return False
+    return super(RacingStorage, self).exists(name)
+
+
+class UploadTest(TestCase):
+  """Chunks append at the right offset and blobs are stored once per content."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.partial_dir = uploads.PARTIAL_DIR
+    self.storage = uploads.default_storage
+    uploads.PARTIAL_DIR = os.path.join(self.directory, 'partial')
+    uploads.default_storage = FileSystemStorage(
+        location=os.path.join(self.directory, 'media'))
+    user = User.objects.create(username='uploader')
+    self.upload = ChunkedUpload.objects.create(user=user, filename='a.txt', size=10)
+
+  def tearDown(self):
+    uploads.PARTIAL_DIR = self.partial_dir
+    uploads.default_storage = self.storage
+    shutil.rmtree(self.directory)
+
+  def read_partial(self):
+    with open(uploads.get_partial_path(self.upload), 'rb') as partial:
+      return partial.read()
+
+  def test_wrong_offset(self):
+    uploads.append_chunk(self.upload, 0, io.BytesIO(b'01234'), 5)
+    self.assertRaises(ValueError, uploads.append_chunk,
+                      self.upload, 3, io.BytesIO(b'34567'), 5)
+    self.assertEqual(ChunkedUpload.objects.get(pk=self.upload.pk).received, 5)
+    self.assertEqual(self.read_partial(), b'01234')
+
+  def test_overrun(self):
+    self.assertRaises(ValueError, uploads.append_chunk,
+                      self.upload, 0, io.BytesIO(b'0123456789ab'), 12)
+    self.assertEqual(ChunkedUpload.objects.get(pk=self.upload.pk).received, 0)
+
+  def test_resume_after_short_read(self):
+    # The connection drops after 4 of 10 bytes; the client resumes at 4.
+    uploads.append_chunk(self.upload, 0, io.BytesIO(b'0123'), 10)
+    self.assertEqual(ChunkedUpload.objects.get(pk=self.upload.pk).received, 4)
+    uploads.append_chunk(self.upload, 4, io.BytesIO(b'456789'), 6)
+    self.assertEqual(self.upload.received, 10)
+    self.assertEqual(self.read_partial(), b'0123456789')
+    uploads.finish_upload(self.upload)
+    with uploads.default_storage.open(self.upload.blob) as blob:
+      self.assertEqual(blob.read(), b'0123456789')
+    self.assertFalse(os.path.exists(uploads.get_partial_path(self.upload)))
+
+  def test_store_blob_dedup(self):
+    name = uploads.store_blob(ContentFile(b'same'))
+    self.assertEqual(name, uploads.get_blob_name(hashlib.sha256(b'same').hexdigest()))
+    self.assertEqual(uploads.store_blob(ContentFile(b'same')), name)
+    self.assertNotEqual(uploads.store_blob(ContentFile(b'other')), name)
+    directory = os.path.dirname(name)
+    self.assertEqual(uploads.default_storage.listdir(directory)[1],
+                     [os.path.basename(name)])
+
+  def test_store_blob_race(self):
+    name = uploads.store_blob(ContentFile(b'same'))
+    uploads.default_storage = RacingStorage(
+        location=uploads.default_storage.location)
+    self.assertEqual(uploads.store_blob(ContentFile(b'same')), name)
+    self.assertEqual(uploads.default_storage.listdir(os.path.dirname(name))[1],
+                     [os.path.basename(name)])
+
+
+@unittest.skipUnless(routers.READ_REPLICA in settings.DATABASES,
+                     'needs a %s database next to default' % routers.READ_REPLICA)
+@override_settings(DATABASE_ROUTERS=['registration.routers.ReadReplicaRouter'])
+class ReadReplicaRouterTest(TestCase):
+  """Reads go to the replica unless the user has just written something."""
+  multi_db = True
+
+  def setUp(self):
+    self.router = routers.ReadReplicaRouter()
+    self.middleware = PrimaryPinningMiddleware()
+    self.factory = RequestFactory()
+    # The router keeps syncdb off the replica, which replication fills in
+    # production, so give the test replica its own table by hand.
+    replica = connections[routers.READ_REPLICA]
+    if Lbw._meta.db_table not in replica.introspection.table_names():
+      with replica.schema_editor() as editor:
+        editor.create_model(Lbw)
+    # Different rows in each database show where a read went.
+    for alias in (routers.PRIMARY, routers.READ_REPLICA):
+      start_date = timezone.now()
+      Lbw.objects.using(alias).create(
+          short_name=alias, description=alias, location=alias,
+          start_date=start_date, end_date=start_date + datetime.timedelta(days=7))
+
+  def tearDown(self):
+    routers.pin_to_primary(False)
+
+  def get_read_db(self, request):
+    """Run request through the middleware and return the database it read from."""
+    self.middleware.process_request(request)
+    alias = Lbw.objects.get().short_name
+    self.middleware.process_response(request, HttpResponse())
+    return alias
+
+  def get_pin_cookie(self):
+    request = self.factory.post('/')
+    self.middleware.process_request(request)
+    response = self.middleware.process_response(request, HttpResponse())
+    return response.cookies[PIN_COOKIE].value
+
+  def get_request_with_cookie(self, value):
+    request = self.factory.get('/')
+    request.COOKIES[PIN_COOKIE] = value
+    return request
+
+  def test_unpinned_get_reads_replica(self):
+    self.assertEqual(self.get_read_db(self.factory.get('/')), routers.READ_REPLICA)
+
+  def test_writes_go_to_primary(self):
+    self.middleware.process_request(self.factory.get('/'))
+    start_date = timezone.now()
+    Lbw.objects.create(short_name='New', description='New', location='New',
+                       start_date=start_date, end_date=start_date)
+    self.assertTrue(Lbw.objects.using(routers.PRIMARY).filter(
+        short_name='New').exists())
+    self.assertFalse(Lbw.objects.using(routers.READ_REPLICA).filter(
+        short_name='New').exists())
+
+  def test_reads_primary_without_replica(self):
+    read_replica = routers.READ_REPLICA
+    routers.READ_REPLICA = 'missing'
+    try:
+      self.assertEqual(self.get_read_db(self.factory.get('/')), routers.PRIMARY)
+    finally:
+      routers.READ_REPLICA = read_replica
+
+  def test_post_reads_primary(self):
+    self.assertEqual(self.get_read_db(self.factory.post('/')), routers.PRIMARY)
+
+  def test_pinned_get_reads_primary(self):
+    cookie = self.get_pin_cookie()
+    self.assertEqual(self.get_read_db(self.get_request_with_cookie(cookie)),
+                     routers.PRIMARY)
+    # The pin ends with the response.
+    self.assertEqual(Lbw.objects.get().short_name, routers.READ_REPLICA)
+
+  def test_expired_cookie_does_not_pin(self):
+    signer = signing.get_cookie_signer(salt=PIN_COOKIE)
+    timestamp = baseconv.base62.encode(int(time.time()) - PIN_SECONDS - 60)
+    expired = signing.Signer.sign(signer, '1%s%s' % (signer.sep, timestamp))
+    self.assertEqual(self.get_read_db(self.get_request_with_cookie(expired)),
+                     routers.READ_REPLICA)
+
+  def test_tampered_cookie_does_not_pin(self):
+    cookie = self.get_pin_cookie()
+    tampered = cookie[:-1] + ('b' if cookie.endswith('a') else 'a')
+    self.assertEqual(self.get_read_db(self.get_request_with_cookie(tampered)),
+                     routers.READ_REPLICA)
+    self.assertEqual(self.get_read_db(self.get_request_with_cookie('1')),
+                     routers.READ_REPLICA)
+
+  def test_allow_migrate(self):
+    self.assertTrue(self.router.allow_migrate(routers.PRIMARY, Lbw))
+    self.assertFalse(self.router.allow_migrate(routers.READ_REPLICA, Lbw))
@@ -0,0 +1,108 @@
+"""Resumable chunked uploads and content addressed attachment storage."""
+import datetime
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from registration.models import ChunkedUpload
+
+COPY_SIZE = 64 * 1024
+# Kept out of MEDIA_ROOT: unfinished uploads belong to their uploader only.
+PARTIAL_DIR = getattr(settings, 'LBW_PARTIAL_UPLOAD_DIR',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'partial_uploads'))
+BLOB_DIR = 'attachments/blobs'
+MAX_UPLOAD_SIZE = getattr(settings, 'LBW_MAX_UPLOAD_SIZE', 100 * 1024 * 1024)
+# How long an upload may take, or wait to be attached, before it is removed.
+UPLOAD_EXPIRY = datetime.timedelta(
+    hours=getattr(settings, 'LBW_UPLOAD_EXPIRY_HOURS', 48))
+
+
+def get_blob_name(digest):
+  """Storage name of the file with the given sha256 hex digest."""
+  return '%s/%s/%s' % (BLOB_DIR, digest[:2], digest)
+
+
+def store_blob(content):
+  """Store a file under its content hash and return its storage name.
+
+  content is anything with chunks() (an UploadedFile or a File).  If a file
+  with the same content is already stored it is reused.
+  """
+  digest = hashlib.sha256()
+  for chunk in content.chunks():
+    digest.update(chunk)
+  name = get_blob_name(digest.hexdigest())
+  if not default_storage.exists(name):
+    content.seek(0)
+    saved = default_storage.save(name, content)
+    if saved != name:
+      # The same content was stored under name since exists() was asked,
+      # and the storage picked another name for this copy.
+      default_storage.delete(saved)
+  return name
+
+
+def get_partial_path(upload):
+  return os.path.join(PARTIAL_DIR, '%d' % upload.id)
+
+
+def append_chunk(upload, offset, stream, length):
+  """Write length bytes read from stream to upload at offset.
+
+  The chunk must start where the last one ended; a client resuming after a
+  dropped connection asks for upload.received first.  Anything a broken
+  earlier request left behind after upload.received is overwritten.
+  """
+  if offset != upload.received:
+    raise ValueError('Expected offset %d, got %d' % (upload.received, offset))
+  if length < 0 or offset + length > upload.size:
+    raise ValueError('Chunk runs past the end of the upload')
+  if not os.path.isdir(PARTIAL_DIR):
+    os.makedirs(PARTIAL_DIR)
+  path = get_partial_path(upload)
+  with open(path, 'r+b' if os.path.exists(path) else 'wb') as partial:
+    partial.seek(offset)
+    partial.truncate()
+    remaining = length
+    while remaining:
+      data = stream.read(min(COPY_SIZE, remaining))
+      if not data:
+        break
+      partial.write(data)
+      remaining -= len(data)
+  upload.received = offset + length - remaining
+  upload.save()
+
+
+def finish_upload(upload):
+  """Move a complete upload into content addressed storage."""
+  path = get_partial_path(upload)
+  with open(path, 'rb') as partial:
+    upload.blob = store_blob(File(partial))
+  os.remove(path)
+  upload.save()
+
+
+def expire_uploads():
+  """Remove uploads older than UPLOAD_EXPIRY and their partial files.
+
+  Finished uploads only lose their ChunkedUpload row; the stored blob stays,
+  as activities may refer to it.  Returns the number of uploads removed.
+  """
+  expired = ChunkedUpload.objects.filter(
+      created__lt=timezone.now() - UPLOAD_EXPIRY)
+  removed = 0
+  for upload in expired:
+    if not upload.finished():
+      try:
+        os.remove(get_partial_path(upload))
+      except OSError:
+        pass
+    upload.delete()
+    removed += 1
+  return removed
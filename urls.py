@@ -24,6 +24,8 @@ urlpatterns = patterns('',
     url(r'^(?P<lbw_id>\d+)/propose_activity/$', views.propose_activity, name='propose_activity'),
     # example: /5/schedule/
     url(r'^(?P<lbw_id>\d+)/schedule/$', views.schedule, name='schedule'),
+    # example: /5/agenda/
+    url(r'^(?P<lbw_id>\d+)/agenda/$', views.agenda, name='agenda'),
     # example: /5/tshirts/
     url(r'^(?P<lbw_id>\d+)/tshirts/$', views.tshirts, name='tshirts'),
     # example: /5/rides/
@@ -59,6 +61,11 @@ urlpatterns = patterns('',
     url(r'^(?P<lbw_id>\d+)/activity/(?P<activity_id>\d+)/attachment$',
         views.activity_attachment, name='activity_attachment'),
 
+    # example: /upload/
+    url(r'^upload/$', views.start_upload, name='start_upload'),
+    # example: /upload/3/?offset=1048576
+    url(r'^upload/(?P<upload_id>\d+)/$', views.upload_chunk, name='upload_chunk'),
+
     # example: /5/message/1/
     url(r'^(?P<lbw_id>\d+)/write_message/$', views.write_lbw_message,
         name='write_lbw_message'),
@@ -5,25 +5,41 @@ import json
 from crispy_forms.layout import Submit
 
 from django.conf import settings
+from django.contrib import messages
 from django.core import serializers
 from django.core.mail import EmailMessage
 from django.core.urlresolvers import reverse
-from django.http import StreamingHttpResponse, HttpResponse, HttpResponseRedirect, Http404
+from django.db.models import Max
+from django.http import StreamingHttpResponse, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, Http404
 from django.shortcuts import render, get_object_or_404
 from django.template.loader import render_to_string
+from django.utils import formats
+from django.utils import timezone
 from django.utils.timezone import UTC
 from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
 
 from registration.models import Accommodation
 from registration.models import Activity
+from registration.models import ChunkedUpload
 from registration.models import Lbw
 from registration.models import Message
+from registration.models import Ride
 from registration.models import UserRegistration
 from registration.forms import ActivityForm
 from registration.forms import AccommodationForm
 from registration.forms import LbwForm
 from registration.forms import MessageForm
+from registration.forms import RideForm
 from registration.forms import UserRegistrationForm
+from registration.agenda import get_agenda
+from registration.agenda import get_clashes
+from registration.rides import is_candidate
+from registration.rides import match_rides
+from registration import purge
+from registration import snapshots
+from registration import uploads
 
 import codecs
 codecs.register(lambda name: codecs.lookup('utf8') if name == 'utf8mb4' else None)
@@ -31,15 +47,76 @@ codecs.register(lambda name: codecs.lookup('utf8') if name == 'utf8mb4' else Non
 def get_basic_template_info(lbw_id=None):
   context = {}
   if lbw_id:
-    context['lbw'] = get_object_or_404(Lbw, pk=lbw_id)
-  context['lbws'] = Lbw.objects.order_by('-start_date')
+    context['lbw'] = get_object_or_404(Lbw, pk=lbw_id, hidden=False)
+  context['lbws'] = Lbw.objects.filter(hidden=False).order_by('-start_date')
   return context
 
+def touch_lbw(lbw_id):
+  """Mark an LBW as changed, for deletes that leave no updated timestamp behind."""
+  Lbw.objects.filter(pk=lbw_id).update(updated=timezone.now())
+
+def get_last_changed(request, lbw_id=None, **kwargs):
+  """When the page for lbw_id (or the index) last changed, for conditional GETs.
+
+  LBW pages also change with time alone: until the LBW has finished their
+  countdowns move on every hour, or every minute close to its start and
+  end, and they look different once it has finished.
+  """
+  if not hasattr(request, 'lbw_last_changed'):
+    request.lbw_finished = False
+    # Every page lists all the LBWs in its sidebar; hiding one touches it too.
+    times = [Lbw.objects.aggregate(Max('updated'))['updated__max']]
+    if lbw_id:
+      try:
+        lbw = Lbw.objects.get(pk=lbw_id, hidden=False)
+      except Lbw.DoesNotExist:
+        request.lbw_last_changed = None
+        return None
+      request.lbw_finished = lbw.finished()
+      times.append(lbw.LastChanged())
+      if request.lbw_finished:
+        times.append(lbw.end_date)
+      else:
+        now = timezone.localtime(timezone.now())
+        # timesince and timeuntil show two units: days and hours, or hours
+        # and minutes within a day of the start or end.
+        if min(abs(now - lbw.start_date),
+               abs(lbw.end_date - now)) < datetime.timedelta(days=1):
+          times.append(now.replace(second=0, microsecond=0))
+        else:
+          times.append(now.replace(minute=0, second=0, microsecond=0))
+    elif request.user.is_authenticated():
+      # The index lists the LBWs the user registered for.
+      times.append(UserRegistration.objects.filter(user=request.user).aggregate(
+          Max('updated'))['updated__max'])
+    times = [time for time in times if time]
+    request.lbw_last_changed = max(times) if times else None
+  return request.lbw_last_changed
+
+def get_page_etag(request, lbw_id=None, **kwargs):
+  """Pages differ between users and before/after the LBW, so the ETag says which."""
+  last_changed = get_last_changed(request, lbw_id)
+  if last_changed is None:
+    return None
+  return '%s-%s-%s' % (last_changed.isoformat(),
+                       'finished' if request.lbw_finished else 'open',
+                       request.user.id or 'anonymous')
+
+@vary_on_cookie
+@condition(etag_func=get_page_etag, last_modified_func=get_last_changed)
 def index(request):
   """Print out an index of the known LBWs."""
   context = get_basic_template_info()
+  if request.user.is_authenticated():
+    lbwuser = request.user.lbwuser
+    context['owned_lbws'] = lbwuser.lbw_owners.filter(hidden=False)
+    context['registered_lbws'] = request.user.lbw_attendees.filter(
+        hidden=False).exclude(owners=lbwuser)
   return render(request, 'registration/index.html', context)
 
+@vary_on_cookie
+@snapshots.frozen('detail.html')
+@condition(etag_func=get_page_etag, last_modified_func=get_last_changed)
 def detail(request, lbw_id):
   """Print out a particular LBW."""
   context = get_basic_template_info(lbw_id)
@@ -47,6 +124,7 @@ def detail(request, lbw_id):
   lbw_messages = None
   if request.user.is_authenticated():
     context['lbw_messages'] = Message.objects.filter(lbw_id=lbw_id).filter(activity=None)
+    context['agenda'] = get_agenda(lbw_id, request.user)
   return render(request, 'registration/detail.html', context)
 
 def deregister(request, lbw_id):
@@ -71,6 +149,8 @@ def register(request, lbw_id):
     if action == "Deregister":
       if user_registration.id:
         user_registration.delete()
+        touch_lbw(lbw_id)
+        snapshots.thaw_lbw(lbw_id)
       return HttpResponseRedirect(reverse('registration:detail',
                                   args=(lbw_id,)))
     user_registration_form = UserRegistrationForm(request.POST,
@@ -78,6 +158,7 @@ def register(request, lbw_id):
                                                   lbw=lbw_id)
     if user_registration_form.is_valid():
       user_registration_form.save()
+      snapshots.thaw_lbw(lbw_id)
       return HttpResponseRedirect(
           reverse('registration:detail', args=(lbw_id,)))
   else:
@@ -86,9 +167,18 @@ def register(request, lbw_id):
   context['user_registration_form'] = user_registration_form
   return render(request, 'registration/register.html', context)
 
+@vary_on_cookie
+@snapshots.frozen('activities.html')
+@condition(etag_func=get_page_etag, last_modified_func=get_last_changed)
 def activities(request, lbw_id):
   """Get all the activities for an LBW."""
   context = get_basic_template_info(lbw_id)
+  if request.user.is_authenticated():
+    # Only owners get schedule pickers, so only they need their choices.
+    lbwuser = request.user.lbwuser
+    context['can_schedule'] = (
+        lbwuser in context['lbw'].owners.all() or
+        lbwuser.activity_owners.filter(lbw_id=lbw_id).exists())
   return render(request, 'registration/activities.html', context)
 
 def propose_activity(request, lbw_id):
@@ -99,14 +189,15 @@ def propose_activity(request, lbw_id):
   context = get_basic_template_info(lbw_id)
   if request.method == 'POST':
     instance = Activity(lbw_id=lbw_id)
-    activity_form = ActivityForm(request.POST, instance=instance)
+    activity_form = ActivityForm(request.POST, instance=instance,
+                                 user=request.user)
     if activity_form.is_valid():
       act = activity_form.save()
       if not act.owners.count():
         act.owners.add(request.user.lbwuser)
-      if 'attachment' in request.FILES:
-        act.attachment = request.FILES['attachment']
+      save_attachment(request, act, activity_form)
       act.save()
+      snapshots.thaw_lbw(lbw_id)
       if settings.LBW_TO_EMAIL:
         message = render_to_string('registration/new_activity.html',
                                    {'lbw': context['lbw'], 'activity': act,
@@ -125,6 +216,14 @@ def propose_activity(request, lbw_id):
   activity_form.helper.add_input(Submit("submit", "Propose"))
   return render(request, 'registration/propose_activity.html', context)
 
+def save_attachment(request, act, activity_form):
+  """Point act.attachment at the content addressed copy of its upload."""
+  upload = activity_form.cleaned_data.get('attachment_upload')
+  if upload:
+    act.attachment.name = upload.blob
+  elif 'attachment' in request.FILES:
+    act.attachment.name = uploads.store_blob(request.FILES['attachment'])
+
 def get_date_from_schedule_post(schedule_post):
   """Parse POST data to find a date."""
   try:
@@ -140,6 +239,8 @@ def get_date_from_schedule_post(schedule_post):
   except KeyError:
     return None
 
+@vary_on_cookie
+@snapshots.frozen('activity-%(activity_id)s.html')
 def activity(request, lbw_id, activity_id):
   """Print details for one activity."""
   context = get_basic_template_info(lbw_id)
@@ -149,14 +250,19 @@ def activity(request, lbw_id, activity_id):
   if request.method == 'POST':
     act.start_date = get_date_from_schedule_post(request.POST)
     act.save()
+    snapshots.thaw_lbw(lbw_id)
     return HttpResponseRedirect(reverse('registration:activities',
                                         args=(lbw_id,)))
   return render(request, 'registration/activity.html', context)
 
+def format_local_time(value):
+  """Format a datetime in the current time zone, as templates would show it."""
+  return formats.date_format(timezone.localtime(value), 'DATETIME_FORMAT')
+
 def activity_register(request, lbw_id, activity_id):
   """Toggle a user registration for an activity."""
   activity = get_object_or_404(Activity, pk=activity_id)
-  lbw = get_object_or_404(Lbw, pk=lbw_id)
+  lbw = get_object_or_404(Lbw, pk=lbw_id, hidden=False)
   if lbw.id != activity.lbw_id:
       raise Http404
   if not request.user.is_authenticated():
@@ -166,10 +272,27 @@ def activity_register(request, lbw_id, activity_id):
     activity.attendees.remove(request.user)
   else:
     activity.attendees.add(request.user)
+    for other in get_clashes(activity, request.user):
+      messages.warning(request, 'This clashes with %s (%s - %s).' % (
+          other.short_name, format_local_time(other.start_date),
+          format_local_time(other.end_date())), fail_silently=True)
   activity.save()
+  snapshots.thaw_lbw(lbw_id)
   return HttpResponseRedirect(reverse('registration:activity',
                                       args=(lbw_id, activity_id)))
 
+def agenda(request, lbw_id):
+  """Print out the activities a user is attending, with clashes."""
+  if not request.user.is_authenticated():
+    return HttpResponseRedirect(reverse('registration:detail',
+                                args=(lbw_id,)))
+  context = get_basic_template_info(lbw_id)
+  context['agenda'] = get_agenda(lbw_id, request.user)
+  return render(request, 'registration/agenda.html', context)
+
+@vary_on_cookie
+@snapshots.frozen('schedule.html')
+@condition(etag_func=get_page_etag, last_modified_func=get_last_changed)
 def schedule(request, lbw_id):
   """Print out a schedule for an LBW."""
   context = get_basic_template_info(lbw_id)
@@ -180,8 +303,54 @@ def tshirts(request, lbw_id):
   return HttpResponse("Showing tshirts for lbw %s." % lbw_id)
 
 def rides(request, lbw_id):
-  """Nothing."""
-  return HttpResponse("Showing rides for lbw %s." % lbw_id)
+  """Offer, request and match rides for an LBW."""
+  if not request.user.is_authenticated():
+    return HttpResponseRedirect(reverse('registration:detail',
+                                args=(lbw_id,)))
+  context = get_basic_template_info(lbw_id)
+  if request.method == 'POST':
+    action = request.POST.get('submit')
+    if action in ('Offer', 'Request'):
+      ride = Ride(lbw_id=lbw_id)
+      if action == 'Offer':
+        ride.offerer = request.user
+      else:
+        ride.requester = request.user
+      ride_form = RideForm(request.POST, instance=ride)
+      if ride_form.is_valid():
+        ride_form.save()
+        return HttpResponseRedirect(reverse('registration:rides',
+                                            args=(lbw_id,)))
+    else:
+      if action == 'Accept':
+        offer = get_object_or_404(Ride, pk=request.POST.get('offer_id'),
+                                  lbw_id=lbw_id, requester=None)
+        ride_request = get_object_or_404(Ride, pk=request.POST.get('request_id'),
+                                         lbw_id=lbw_id, offerer=None)
+        if request.user.id in (offer.offerer_id, ride_request.requester_id):
+          # The ids come from the form, so check they still are a match.
+          if not is_candidate(context['lbw'], offer, ride_request):
+            return HttpResponseBadRequest('The offer does not match the request')
+          offer.requester_id = ride_request.requester_id
+          if ride_request.notes:
+            offer.notes = ' / '.join(filter(None, [offer.notes, ride_request.notes]))
+          offer.save()
+          ride_request.delete()
+      elif action == 'Cancel':
+        ride = get_object_or_404(Ride, pk=request.POST.get('ride_id'),
+                                 lbw_id=lbw_id)
+        if request.user.id in (ride.offerer_id, ride.requester_id):
+          ride.delete()
+      return HttpResponseRedirect(reverse('registration:rides',
+                                          args=(lbw_id,)))
+  else:
+    ride_form = RideForm()
+  context['ride_form'] = ride_form
+  context['ride_matches'], context['ride_offers'] = match_rides(context['lbw'])
+  context['matched_rides'] = Ride.objects.filter(
+      lbw_id=lbw_id, offerer__isnull=False, requester__isnull=False).select_related(
+          'offerer', 'requester')
+  return render(request, 'registration/rides.html', context)
 
 def participants(request, lbw_id):
   """Print out everyone going to an LBW."""
@@ -248,6 +417,7 @@ def delete_message(request, lbw_id, message_id):
       message = get_object_or_404(Message, pk=message_id)
       if request.user == message.writer:
         message.delete()
+        touch_lbw(lbw_id)
         return HttpResponse('ok')
     except KeyError:
       return HttpResponse('incorrectly formatted request')
@@ -264,6 +434,7 @@ def propose_lbw(request):
       if not lbw.owners.count():
         lbw.owners.add(request.user.lbwuser)
         lbw.save()
+      snapshots.thaw_all()
       if settings.LBW_TO_EMAIL:
           message = render_to_string('registration/new_lbw.html',
                                      {'lbw': lbw, 'domain': request.get_host()})
@@ -280,22 +451,30 @@ def propose_lbw(request):
   return render(request, 'registration/propose_lbw.html', context)
 
 def delete_lbw(request, lbw_id):
-  """Delete an LBW."""
-  context = get_basic_template_info(lbw_id)
-  lbw = context['lbw']
-  if request.method == 'POST':
-    form_lbw_id = request.POST['lbw_id']
-    if request.user.lbwuser in lbw.owners.all():
-      lbw.delete()
-      return HttpResponseRedirect(
-          reverse('registration:index'))
-  else:
-    lbw = get_object_or_404(Lbw, pk=lbw_id)
-    if request.user.lbwuser in lbw.owners.all():
-      return render(request, 'registration/delete_lbw.html', context)
-    else:
-      return HttpResponseRedirect(
-          reverse('registration:index'))
+  """Delete an LBW, or show how far its deletion has got.
+
+  The LBW is hidden straight away; purge_lbws deletes it in the background.
+  """
+  try:
+    lbw = Lbw.objects.get(pk=lbw_id)
+  except Lbw.DoesNotExist:
+    # purge_lbws has finished while the owner watched the progress page.
+    messages.info(request, 'The LBW has been deleted.', fail_silently=True)
+    return HttpResponseRedirect(reverse('registration:index'))
+  if (not request.user.is_authenticated() or
+      request.user.lbwuser not in lbw.owners.all()):
+    return HttpResponseRedirect(
+        reverse('registration:index'))
+  context = get_basic_template_info()
+  context['lbw'] = lbw
+  if request.method == 'POST' and not lbw.hidden:
+    Lbw.objects.filter(pk=lbw.id).update(hidden=True, updated=timezone.now())
+    snapshots.thaw_all()
+    return HttpResponseRedirect(
+        reverse('registration:delete_lbw', args=(lbw_id,)))
+  if lbw.hidden:
+    context['remaining'] = purge.get_remaining(lbw_id)
+  return render(request, 'registration/delete_lbw.html', context)
 
 def update_lbw(request, lbw_id):
   """Update an LBW."""
@@ -311,6 +490,7 @@ def update_lbw(request, lbw_id):
       if not lbw.owners.count():
         lbw.owners.add(request.user.lbwuser)
         lbw.save()
+      snapshots.thaw_all()
       return HttpResponseRedirect(
           reverse('registration:detail', args=(lbw.id,)))
   else:
@@ -324,14 +504,14 @@ def update_activity(request, lbw_id, activity_id):
     raise Http404
   if request.method == 'POST':
     activity_form = context['activity_form'] = ActivityForm(
-            request.POST, instance=activity)
+            request.POST, instance=activity, user=request.user)
     if activity_form.is_valid():
       act = activity_form.save()
       if not act.owners.count():
         act.owners.add(request.user.lbwuser)
-      if 'attachment' in request.FILES:
-        act.attachment = request.FILES['attachment']
+      save_attachment(request, act, activity_form)
       act.save()
+      snapshots.thaw_lbw(lbw_id)
       return HttpResponseRedirect(reverse('registration:activities',
                                   args=(lbw_id,)))
   else:
@@ -345,23 +525,72 @@ def cancel_activity(request, lbw_id, activity_id):
     try:
       activity = get_object_or_404(Activity, pk=activity_id)
       if request.user.lbwuser in activity.owners.all():
-        activity.delete()
+        # Detach it now; purge_lbws deletes it and its messages later.
+        Activity.objects.filter(pk=activity.id).update(cancelled=True, lbw=None)
+        touch_lbw(lbw_id)
+        snapshots.thaw_lbw(lbw_id)
         return HttpResponse('ok')
     except KeyError:
       return HttpResponse('incorrectly formatted request')
   else:
     raise Http404
 
+def get_upload_status(upload):
+  return HttpResponse(json.dumps({
+      'url': reverse('registration:upload_chunk', args=(upload.id,)),
+      'upload_id': upload.id,
+      'size': upload.size,
+      'received': upload.received,
+      'finished': upload.finished()}), content_type="application/json")
+
+def start_upload(request):
+  """Start a resumable attachment upload."""
+  if not request.user.is_authenticated() or request.method != 'POST':
+    raise Http404
+  try:
+    size = int(request.POST['size'])
+  except (KeyError, ValueError):
+    return HttpResponseBadRequest('size is required')
+  if not 0 < size <= uploads.MAX_UPLOAD_SIZE:
+    return HttpResponseBadRequest('Attachments can be at most %d bytes'
+                                  % uploads.MAX_UPLOAD_SIZE)
+  upload = ChunkedUpload.objects.create(
+      user=request.user, size=size,
+      filename=request.POST.get('filename', '')[:1001])
+  return get_upload_status(upload)
+
+def upload_chunk(request, upload_id):
+  """Report how much of an upload has arrived, or append a chunk to it.
+
+  Chunks are POSTed as the raw request body with their position in the
+  offset query parameter, and are streamed to disk.
+  """
+  if not request.user.is_authenticated():
+    raise Http404
+  upload = get_object_or_404(ChunkedUpload, pk=upload_id, user=request.user)
+  if request.method == 'POST' and not upload.finished():
+    try:
+      offset = int(request.GET['offset'])
+      length = int(request.META.get('CONTENT_LENGTH') or 0)
+      uploads.append_chunk(upload, offset, request, length)
+    except (KeyError, ValueError) as error:
+      return HttpResponseBadRequest(str(error))
+    if upload.received == upload.size:
+      uploads.finish_upload(upload)
+  return get_upload_status(upload)
+
 def activity_attachment(request, lbw_id, activity_id):
   """Return the attachment for an activity."""
   activity = get_object_or_404(Activity, pk=activity_id)
-  lbw = get_object_or_404(Lbw, pk=lbw_id)
+  lbw = get_object_or_404(Lbw, pk=lbw_id, hidden=False)
   if lbw.id != activity.lbw_id:
     raise Http404
   if not activity.attachment:
     raise Http404
   return StreamingHttpResponse(activity.attachment.chunks())
 
+@vary_on_cookie
+@snapshots.frozen('accommodation.html')
 def accommodation(request, lbw_id):
   context = get_basic_template_info(lbw_id)
   if request.method == 'POST':
@@ -372,6 +601,7 @@ def accommodation(request, lbw_id):
       if context['accommodation_form'].is_valid():
         acc = context['accommodation_form'].save()
 	acc.save()
+	snapshots.thaw_lbw(lbw_id)
   else:
     context['accommodation_form'] = AccommodationForm()
   return render(request, 'registration/accommodation.html', context)
@@ -385,11 +615,8 @@ def get_serializable_value(value):
   else:
     return str(value)
 
-def details_json(request, lbw_id):
-  if not request.user.is_authenticated():
-    return HttpResponseRedirect(reverse('registration:detail',
-                                args=(lbw_id,)))
-  lbw = get_object_or_404(Lbw, pk=lbw_id)
+def get_lbw_details(lbw):
+  """Everything about an LBW, as exported by details_json."""
   data = {}
   fields = ['description', 'end_date', 'short_name',
             'location', 'lbw_url', 'start_date']
@@ -411,5 +638,16 @@ def details_json(request, lbw_id):
     for attendee in activity.attendees.all():
       activity_details['attendees'].append(get_serializable_value(attendee))
     data['activities'].append(activity_details)
-  
-  return HttpResponse(json.dumps(data), content_type="application/json")
+  return data
+
+def details_json(request, lbw_id):
+  if not request.user.is_authenticated():
+    return HttpResponseRedirect(reverse('registration:detail',
+                                args=(lbw_id,)))
+  content = snapshots.read_snapshot(lbw_id, 'details.json')
+  if content is None:
+    lbw = get_object_or_404(Lbw, pk=lbw_id, hidden=False)
+    content = json.dumps(get_lbw_details(lbw))
+    if lbw.finished():
+      snapshots.write_snapshot(lbw_id, 'details.json', content)
+  return HttpResponse(content, content_type="application/json")